@@ -1,16 +1,22 @@
 import os
+import asyncio
 import logging
+import aiohttp
+import numpy as np
+import orjson
 import pandas as pd
 from time import sleep
-from typing import Dict, List, Optional
+from typing import List, Optional
 from functools import wraps
-from io import BytesIO
 from datetime import datetime
 
 from binance.client import Client
+from binance.helpers import convert_ts_str
 from requests.exceptions import RequestException
 from binance.exceptions import BinanceAPIException
 
+from excel_writer import df_to_excel_bytes
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -35,6 +41,63 @@ NUMERIC_COLUMNS = [
     'NumberOfTrades', 'TakerBuyBaseAssetVolume', 'TakerBuyQuoteAssetVolume'
 ]
 
+TIME_COLUMNS = ['OpenTime', 'CloseTime']
+
+INT_COLUMNS = ['NumberOfTrades']
+FLOAT_COLUMNS = [col for col in NUMERIC_COLUMNS if col not in INT_COLUMNS]
+
+FLOAT_IDX = [KLINE_COLUMNS.index(col) for col in FLOAT_COLUMNS]
+INT_IDX = [KLINE_COLUMNS.index(col) for col in INT_COLUMNS]
+TIME_IDX = [KLINE_COLUMNS.index(col) for col in TIME_COLUMNS]
+
+# Binance returns at most 1000 klines per request
+KLINE_LIMIT = 1000
+MAX_CONCURRENT_REQUESTS = 8
+MAX_RETRIES = 3
+
+_INTERVAL_MS = {
+    '1s': 1_000, '1m': 60_000, '3m': 180_000, '5m': 300_000, '15m': 900_000, '30m': 1_800_000,
+    '1h': 3_600_000, '2h': 7_200_000, '4h': 14_400_000, '6h': 21_600_000, '8h': 28_800_000,
+    '12h': 43_200_000, '1d': 86_400_000, '3d': 259_200_000, '1w': 604_800_000, '1M': 2_592_000_000,
+}
+
+# Error codes that will fail the same way on every retry: invalid symbol,
+# illegal characters, mandatory parameter missing, invalid API key
+NON_RETRIABLE_CODES = {-1121, -1100, -1102, -2014}
+
+# HTTP 418 means the IP is banned for ignoring 429s, and retrying only
+# extends the ban
+IP_BANNED_STATUS = 418
+
+# Longest Retry-After we wait out, so a bad header can't hang the fetch
+MAX_RETRY_AFTER = 60
+
+class BinanceHTTPError(Exception):
+    """Error response from Binance whose body isn't JSON, e.g. a WAF or proxy page"""
+    def __init__(self, status_code: int, text: str):
+        super().__init__(f"Binance returned HTTP {status_code}: {text[:200]}")
+        self.status_code = status_code
+        self.text = text
+
+def _page_windows(start_ms: int, end_ms: int, interval_ms: int) -> List[tuple]:
+    """Split a range into inclusive (startTime, endTime) windows of at most KLINE_LIMIT klines"""
+    step = KLINE_LIMIT * interval_ms
+    return [(start, min(start + step - 1, end_ms)) for start in range(start_ms, end_ms, step)]
+
+def _retry_after(response) -> Optional[float]:
+    """Seconds to wait according to a response's Retry-After header, if any, capped at MAX_RETRY_AFTER"""
+    value = getattr(response, 'headers', {}).get('Retry-After')
+    try:
+        return min(float(value), MAX_RETRY_AFTER) if value else None
+    except ValueError:
+        return None
+
+def _retried_per_page(e: Exception) -> bool:
+    """Whether _fetch_page already retried this error, so re-running the whole fetch won't help"""
+    if isinstance(e, aiohttp.ClientError):
+        return True
+    return isinstance(e, BinanceAPIException) and (e.status_code == 429 or e.status_code >= 500)
+
 def retry_on_api_error(max_retries: int = 3, delay: float = 1.0):
     """Decorator to retry API calls on failure"""
     def decorator(func):
@@ -44,11 +107,21 @@ def retry_on_api_error(max_retries: int = 3, delay: float = 1.0):
             for attempt in range(max_retries):
                 try:
                     return func(*args, **kwargs)
-                except (RequestException, BinanceAPIException) as e:
+                except (RequestException, aiohttp.ClientError, BinanceAPIException) as e:
+                    if isinstance(e, BinanceAPIException) and (
+                        e.code in NON_RETRIABLE_CODES or e.status_code == IP_BANNED_STATUS
+                    ):
+                        logger.error(f"Non-retriable API error in {func.__name__}: {e}")
+                        raise
+                    if _retried_per_page(e):
+                        logger.error(f"API call failed after per-page retries in {func.__name__}: {e}")
+                        raise
                     last_exception = e
                     logger.warning(f"API call failed (attempt {attempt + 1}/{max_retries}): {e}")
                     if attempt < max_retries - 1:
-                        sleep(delay * (2 ** attempt))  # Exponential backoff
+                        # Exponential backoff, unless the response asks for a (capped) Retry-After
+                        wait = _retry_after(getattr(e, 'response', None))
+                        sleep(delay * (2 ** attempt) if wait is None else wait)
                 except Exception as e:
                     logger.error(f"Unexpected error in {func.__name__}: {e}")
                     raise
@@ -85,54 +158,114 @@ class BinanceReadService:
         symbol = symbol.upper().strip()
         return symbol
 
-    def _kline_to_dict(self, kline: List) -> Dict:
-        """Convert kline list to dictionary with proper column names"""
-        return dict(zip(KLINE_COLUMNS, kline))
-
-    def _process_dataframe(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Process raw DataFrame with proper data types and formatting"""
-        if df.empty:
-            return df
-        
-        df['OpenTime'] = pd.to_datetime(df['OpenTime'], unit='ms')
-        df['CloseTime'] = pd.to_datetime(df['CloseTime'], unit='ms')
+    def _process_dataframe(self, klines: List[List]) -> pd.DataFrame:
+        """Build a typed DataFrame from raw klines, casting all numeric columns in one block"""
+        if not klines:
+            return pd.DataFrame()
         
-        for col in NUMERIC_COLUMNS:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col])
+        arr = np.array(klines, dtype=object)
+        floats = arr[:, FLOAT_IDX].astype(np.float64)
+        ints = arr[:, INT_IDX].astype(np.int32)
+        times = arr[:, TIME_IDX].astype(np.int64)
         
-        if 'CanBeIgnored' in df.columns:
-            df = df.drop('CanBeIgnored', axis=1)
+        # CanBeIgnored is never selected
+        data = {}
+        for col in KLINE_COLUMNS:
+            if col in TIME_COLUMNS:
+                data[col] = (times[:, TIME_COLUMNS.index(col)] * 1_000_000).view('datetime64[ns]')
+            elif col in FLOAT_COLUMNS:
+                data[col] = floats[:, FLOAT_COLUMNS.index(col)]
+            elif col in INT_COLUMNS:
+                data[col] = ints[:, INT_COLUMNS.index(col)]
         
-        return df
+        return pd.DataFrame(data, copy=False)
+
+    async def _fetch_page(self, session: aiohttp.ClientSession, sem: asyncio.Semaphore, 
+                          params: dict) -> List[List]:
+        """Fetch a single page of klines, retrying rate limits, server and connection errors"""
+        url = self._client._create_api_uri('klines', signed=False)
+        async with sem:
+            for attempt in range(MAX_RETRIES):
+                last_attempt = attempt == MAX_RETRIES - 1
+                try:
+                    async with session.get(url, params=params) as response:
+                        if (response.status == 429 or response.status >= 500) and not last_attempt:
+                            logger.warning(f"Binance returned {response.status} (attempt {attempt + 1}/{MAX_RETRIES}), backing off")
+                            wait = _retry_after(response)
+                            await asyncio.sleep(2 ** attempt if wait is None else wait)
+                            continue
+                        if response.status >= 400:
+                            # BinanceAPIException can only report JSON bodies
+                            text = await response.text()
+                            try:
+                                orjson.loads(text)
+                            except orjson.JSONDecodeError:
+                                raise BinanceHTTPError(response.status, text) from None
+                            raise BinanceAPIException(response, response.status, text)
+                        return orjson.loads(await response.read())
+                except aiohttp.ClientError as e:
+                    if last_attempt:
+                        raise
+                    logger.warning(f"Page request failed (attempt {attempt + 1}/{MAX_RETRIES}): {e}")
+                    await asyncio.sleep(2 ** attempt)
+
+    async def _fetch_pages(self, symbol: str, interval: str, start_ms: int, end_ms: int,
+                           interval_ms: int) -> List[List[List]]:
+        """Fetch all pages of the range concurrently, preserving window order"""
+        sem = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        async with aiohttp.ClientSession() as session:
+            # Start no earlier than the symbol's first kline, so ranges
+            # reaching back before its listing don't fetch empty pages
+            first = await self._fetch_page(session, sem, {
+                'symbol': symbol,
+                'interval': interval,
+                'startTime': 0,
+                'limit': 1,
+            })
+            if not first:
+                return []
+            start_ms = max(start_ms, first[0][0])
+            
+            return await asyncio.gather(*(
+                self._fetch_page(session, sem, {
+                    'symbol': symbol,
+                    'interval': interval,
+                    'startTime': start,
+                    'endTime': end,
+                    'limit': KLINE_LIMIT,
+                })
+                for start, end in _page_windows(start_ms, end_ms, interval_ms)
+            ))
 
     @retry_on_api_error(max_retries=3)
     def get_historical_klines(self, symbol: str, interval: str, start_time: str, 
-                             end_time: Optional[str] = None) -> List[Dict]:
-        """Get historical klines data, handling pagination to fetch all data in the range."""
+                             end_time: Optional[str] = None) -> List[List]:
+        """Get raw historical klines, fetching the pages of the range concurrently."""
         symbol = self._validate_symbol(symbol)
         
-        all_klines = self._client.get_historical_klines(
-            symbol=symbol,
-            interval=interval,
-            start_str=start_time,
-            end_str=end_time
-        )
+        interval_ms = _INTERVAL_MS.get(interval)
+        if not interval_ms:
+            raise ValueError(f"Unsupported interval: {interval}")
+        
+        start_ms = convert_ts_str(start_time)
+        end_ms = convert_ts_str(end_time) if end_time else int(datetime.now().timestamp() * 1000)
+        
+        pages = asyncio.run(self._fetch_pages(symbol, interval, start_ms, end_ms, interval_ms))
+        all_klines = [kline for page in pages for kline in page]
 
         logger.info(f"Fetched a total of {len(all_klines)} klines for {symbol}")
-        return [self._kline_to_dict(k) for k in all_klines]
+        return all_klines
 
     def get_historical_data_as_dataframe(self, symbol: str, interval: str, 
                                        start_date: str, end_date: Optional[str] = None) -> pd.DataFrame:
         """Get historical klines data as pandas DataFrame"""
         try:
-            klines_data = self.get_historical_klines(symbol, interval, start_date, end_date)
+            klines = self.get_historical_klines(symbol, interval, start_date, end_date)
             
-            if not klines_data:
+            if not klines:
                 return pd.DataFrame()
             
-            df = pd.DataFrame(klines_data)
-            df = self._process_dataframe(df)
+            df = self._process_dataframe(klines)
             
             logger.info(f"Created DataFrame with {len(df)} rows for {symbol}")
             return df
@@ -141,6 +274,10 @@ class BinanceReadService:
             logger.error(f"Error creating DataFrame for {symbol}: {e}")
             return pd.DataFrame()
 
+    def df_to_excel_bytes(self, df: pd.DataFrame, sheet_name: str) -> bytes:
+        """Write an already-built klines DataFrame to Excel bytes"""
+        return df_to_excel_bytes(df, sheet_name)
+
     def export_to_excel(self, symbol: str, interval: str, start_date: str, 
                        end_date: Optional[str] = None) -> Optional[bytes]:
         """Export historical data to Excel bytes"""
@@ -151,33 +288,10 @@ class BinanceReadService:
                 logger.warning(f"No data to export for {symbol}")
                 return None
             
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                df.to_excel(writer, sheet_name=f'{symbol}_{interval}', index=False)
-                
-                workbook = writer.book
-                worksheet = writer.sheets[f'{symbol}_{interval}']
-                
-                header_format = workbook.add_format({
-                    'bold': True,
-                    'text_wrap': True,
-                    'valign': 'top',
-                    'fg_color': '#D7E4BC',
-                    'border': 1
-                })
-                
-                for col_num, value in enumerate(df.columns.values):
-                    worksheet.write(0, col_num, value, header_format)
-                
-                for i, col in enumerate(df.columns):
-                    max_len = max(df[col].astype(str).map(len).max(), len(col)) + 2
-                    worksheet.set_column(i, i, min(max_len, 50))
-            
-            excel_data = output.getvalue()
+            excel_data = self.df_to_excel_bytes(df, f'{symbol}_{interval}')
             logger.info(f"Created Excel file for {symbol} ({len(excel_data)} bytes)")
             return excel_data
             
         except Exception as e:
             logger.error(f"Error creating Excel file for {symbol}: {e}")
             return None
-        
\ No newline at end of file
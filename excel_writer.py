@@ -0,0 +1,39 @@
+import pandas as pd
+from pandas.api.types import is_datetime64_any_dtype, is_numeric_dtype
+from io import BytesIO
+
+# constant_memory flushes each row to disk once written, so rows must be
+# written in order, header first
+EXCEL_OPTIONS = {
+    'constant_memory': True,
+    'strings_to_numbers': False,
+    'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+}
+
+HEADER_FORMAT = {'bold': True, 'text_wrap': True, 'valign': 'top', 'fg_color': '#D7E4BC', 'border': 1}
+
+def _col_width(series: pd.Series, name: str) -> int:
+    """Estimates an Excel column width, only scanning the values of text columns."""
+    if is_datetime64_any_dtype(series):
+        return 20
+    if is_numeric_dtype(series):
+        return max(len(name) + 2, 14)
+    return min(max(series.astype(str).str.len().max(), len(name)) + 2, 50)
+
+def df_to_excel_bytes(df: pd.DataFrame, sheet_name: str) -> bytes:
+    """Writes a DataFrame to a single-sheet Excel file in bytes."""
+    output = BytesIO()
+
+    with pd.ExcelWriter(output, engine='xlsxwriter', engine_kwargs={'options': EXCEL_OPTIONS}) as writer:
+        workbook = writer.book
+        worksheet = workbook.add_worksheet(sheet_name)
+
+        worksheet.write_row(0, 0, df.columns, workbook.add_format(HEADER_FORMAT))
+
+        for i, col in enumerate(df.columns):
+            worksheet.set_column(i, i, _col_width(df[col], col))
+
+        for row_num, row in enumerate(df.itertuples(index=False, name=None), start=1):
+            worksheet.write_row(row_num, 0, row)
+
+    return output.getvalue()
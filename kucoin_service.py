@@ -1,14 +1,35 @@
+import asyncio
 import logging
+import re
+import aiohttp
+import numpy as np
+import orjson
 import pandas as pd
 from io import BytesIO
 from kucoin.client import Client
-import time
 from datetime import datetime, timedelta
+from excel_writer import df_to_excel_bytes
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+KLINE_URL = "https://api.kucoin.com/api/v1/market/candles"
+
+# KuCoin API returns a maximum of 1500 data points per request
+KLINE_LIMIT = 1500
+MAX_CONCURRENT_REQUESTS = 5
+MAX_RETRIES = 3
+
+_INTERVAL_S = {
+    '1min': 60, '3min': 180, '5min': 300, '15min': 900, '30min': 1800,
+    '1hour': 3600, '2hour': 7200, '4hour': 14400, '6hour': 21600, '8hour': 28800, '12hour': 43200,
+    '1day': 86400, '1week': 604800, '1month': 2592000,
+}
+
+# Quote currencies never overlap as suffixes, so the match is unambiguous
+_QUOTE_RE = re.compile(r'^([A-Z0-9]+)(USDT|USDC|TUSD|BUSD|BTC|ETH|KCS)$')
+
 class KuCoinService:
     """Service for fetching and exporting crypto data from KuCoin."""
     
@@ -28,93 +49,137 @@ class KuCoinService:
     def _format_symbol(self, pair: str) -> str:
         """Formats a trading pair like 'BTCUSDT' to KuCoin's 'BTC-USDT' format."""
         pair = pair.upper()
-        bases = ['USDT', 'USDC', 'TUSD', 'BUSD', 'BTC', 'ETH', 'KCS']
-        for base in bases:
-            if pair.endswith(base) and len(pair) > len(base):
-                return f"{pair[:-len(base)]}-{base}"
+        match = _QUOTE_RE.match(pair)
+        if match:
+            return f"{match[1]}-{match[2]}"
         if len(pair) > 3:
              return f"{pair[:-3]}-{pair[-3:]}"
         return pair
 
+    async def _fetch_window(self, session: aiohttp.ClientSession, sem: asyncio.Semaphore, symbol: str, interval: str, start_ts: int, end_ts: int) -> list:
+        """
+        Fetches a single window of K-line data, backing off when rate limited.
+        Raises instead of returning a partial result, so a failed window never
+        leaves a silent gap in the series.
+        """
+        params = {'symbol': symbol, 'type': interval, 'startAt': start_ts, 'endAt': end_ts}
+        async with sem:
+            for attempt in range(MAX_RETRIES):
+                async with session.get(KLINE_URL, params=params) as response:
+                    if response.status == 429:
+                        if attempt == MAX_RETRIES - 1:
+                            break
+                        logger.warning(f"Rate limited by KuCoin (attempt {attempt + 1}/{MAX_RETRIES}), backing off.")
+                        await asyncio.sleep(2 ** attempt)
+                        continue
+                    response.raise_for_status()
+                    payload = orjson.loads(await response.read())
+
+                if payload.get('code') != '200000':
+                    raise RuntimeError(f"KuCoin returned an error for {symbol}: {payload.get('msg')}")
+                return payload.get('data') or []
+
+        raise RuntimeError(f"Rate limited by KuCoin for {symbol} window {start_ts}-{end_ts} after {MAX_RETRIES} attempts")
+
+    async def _fetch_windows(self, symbol: str, interval: str, windows: list, progress_callback=None) -> list:
+        """Fetches all windows concurrently, returning the chunks in the same order as the windows."""
+        sem = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        completed = 0
+
+        async def fetch(session, window):
+            nonlocal completed
+            chunk = await self._fetch_window(session, sem, symbol, interval, *window)
+            completed += 1
+            if progress_callback:
+                progress_callback(completed / len(windows), f"Fetched data from {datetime.fromtimestamp(window[0]).strftime('%Y-%m-%d')}...")
+            return chunk
+
+        async with aiohttp.ClientSession() as session:
+            return await asyncio.gather(*(fetch(session, window) for window in windows))
+
     def get_kline_data_as_dataframe(self, trading_pair: str, interval: str, start_at: datetime, end_at: datetime, progress_callback=None) -> pd.DataFrame:
         """
         Fetches K-line (candlestick) data for a given trading pair, interval, and date range,
-        handling pagination by fetching data in chunks.
+        splitting the range into windows of KLINE_LIMIT points that are fetched concurrently.
         """
         symbol = self._format_symbol(trading_pair)
         logger.info(f"Fetching K-line data for symbol '{symbol}' from {start_at} to {end_at} with interval '{interval}'.")
 
-        all_data = []
-        
-        # KuCoin API returns a maximum of 1500 data points per request
-        limit = 1500
-        
         start_at_ts = int(start_at.timestamp())
         end_at_ts = int(end_at.timestamp())
-        
-        total_duration = end_at_ts - start_at_ts
-        
-        current_end_ts = end_at_ts
-
-        while current_end_ts > start_at_ts:
-            try:
-                # Fetch data from current_end_ts backwards
-                kline_chunk = self._client.get_kline_data(
-                    symbol,
-                    interval,
-                    endAt=current_end_ts,
-                    startAt=start_at_ts # We still need a start, the API will limit the result to 1500 points from the end
-                )
-
-                if not kline_chunk:
-                    logger.warning(f"No more K-line data found for {symbol} in the current chunk.")
-                    break
-
-                all_data.extend(kline_chunk)
-                
-                # Get the timestamp of the oldest data point in the chunk
-                oldest_ts_in_chunk = int(kline_chunk[-1][0])
-
-                if progress_callback:
-                    elapsed_duration = end_at_ts - oldest_ts_in_chunk
-                    progress = min(elapsed_duration / total_duration, 1.0)
-                    progress_callback(progress, f"Fetched data up to {datetime.fromtimestamp(oldest_ts_in_chunk).strftime('%Y-%m-%d')}...")
-
-                # If the oldest data is older than our start date, we can stop
-                if oldest_ts_in_chunk <= start_at_ts:
-                    break
-                
-                # Set the end for the next chunk to be just before the oldest data we just received
-                current_end_ts = oldest_ts_in_chunk - 1
-                
-                time.sleep(0.3) # Respect API rate limits
-
-            except Exception as e:
-                logger.error(f"Error fetching K-line data chunk from KuCoin for {symbol}: {e}")
-                # Decide if we should break or continue
-                break
-        
-        if not all_data:
-            return pd.DataFrame()
 
-        # Clean up and format the DataFrame
-        df = pd.DataFrame(all_data, columns=['Timestamp', 'Open', 'Close', 'High', 'Low', 'Amount', 'Volume'])
-        df.drop_duplicates(subset=['Timestamp'], inplace=True)
+        interval_s = _INTERVAL_S.get(interval)
+        if not interval_s:
+            raise ValueError(f"Unsupported interval: {interval}")
 
-        for col in ['Open', 'Close', 'High', 'Low', 'Amount', 'Volume']:
-            df[col] = pd.to_numeric(df[col])
+        # Each window covers at most KLINE_LIMIT points, newest window first
+        step = KLINE_LIMIT * interval_s
+        windows = [
+            (max(start_at_ts, window_end - step), window_end)
+            for window_end in range(end_at_ts, start_at_ts, -step)
+        ]
 
-        df['Timestamp'] = pd.to_datetime(df['Timestamp'].astype(int), unit='s')
-        
-        # Filter final dataframe to be strictly within the requested date range
-        df = df[(df['Timestamp'] >= start_at) & (df['Timestamp'] <= end_at)]
-        
-        df = df.sort_values(by='Timestamp', ascending=True)
-        df = df[['Timestamp', 'Open', 'High', 'Low', 'Close', 'Amount', 'Volume']]
+        chunks = asyncio.run(self._fetch_windows(symbol, interval, windows, progress_callback))
+        total = sum(len(chunk) for chunk in chunks)
+
+        if not total:
+            logger.warning(f"No K-line data found for {symbol}.")
+            return pd.DataFrame()
+
+        # Fill preallocated typed buffers chunk by chunk; response columns are
+        # time, open, close, high, low, amount, volume
+        timestamps = np.empty(total, dtype=np.int64)
+        values = np.empty((total, 6), dtype=np.float64)
+        offset = 0
+        for chunk in chunks:
+            # Windows before the listing date or inside exchange gaps are empty
+            if not chunk:
+                continue
+            end = offset + len(chunk)
+            timestamps[offset:end] = [kline[0] for kline in chunk]
+            values[offset:end] = [kline[1:] for kline in chunk]
+            offset = end
+
+        # Windows and the klines within them arrive newest first, so reversing
+        # yields ascending order and any duplicates sit next to each other at
+        # window boundaries; the window math already bounds the date range
+        timestamps = timestamps[::-1]
+        values = values[::-1]
+        keep = np.empty(total, dtype=bool)
+        keep[0] = True
+        np.not_equal(timestamps[1:], timestamps[:-1], out=keep[1:])
+        timestamps = timestamps[keep]
+        values = values[keep]
+
+        df = pd.DataFrame({
+            'Timestamp': (timestamps * 1_000_000_000).view('datetime64[ns]'),
+            'Open': values[:, 0],
+            'High': values[:, 2],
+            'Low': values[:, 3],
+            'Close': values[:, 1],
+            'Amount': values[:, 4],
+            'Volume': values[:, 5],
+        }, copy=False)
 
         logger.info(f"Created DataFrame with {len(df)} rows for {symbol}")
         return df
 
+    def df_to_excel_bytes(self, df: pd.DataFrame, sheet_name: str) -> bytes:
+        """Writes an already-built K-line DataFrame to an Excel file in bytes."""
+        return df_to_excel_bytes(df, sheet_name)
+
+    def df_to_parquet_bytes(self, df: pd.DataFrame) -> bytes:
+        """Writes an already-built K-line DataFrame to a zstd-compressed Parquet file in bytes."""
+        output = BytesIO()
+        df.to_parquet(output, engine='pyarrow', compression='zstd', index=False)
+        return output.getvalue()
+
+    def df_to_csv_gz_bytes(self, df: pd.DataFrame) -> bytes:
+        """Writes an already-built K-line DataFrame to a gzip-compressed CSV file in bytes."""
+        output = BytesIO()
+        df.to_csv(output, index=False, compression='gzip')
+        return output.getvalue()
+
     def export_to_excel(self, trading_pair: str, interval: str, start_at: datetime, end_at: datetime, progress_callback=None) -> bytes | None:
         """Exports historical K-line data to an Excel file in bytes."""
         df = self.get_kline_data_as_dataframe(trading_pair, interval, start_at, end_at, progress_callback)
@@ -123,27 +188,6 @@ class KuCoinService:
             logger.warning(f"No data to export for {trading_pair}")
             return None
         
-        output = BytesIO()
-        sheet_name = f"{trading_pair[:15]}_{interval}"
-
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, sheet_name=sheet_name, index=False)
-            
-            workbook = writer.book
-            worksheet = writer.sheets[sheet_name]
-            
-            header_format = workbook.add_format({'bold': True, 'text_wrap': True, 'valign': 'top', 'fg_color': '#D7E4BC', 'border': 1})
-            
-            for col_num, value in enumerate(df.columns.values):
-                worksheet.write(0, col_num, value, header_format)
-            
-            for i, col in enumerate(df.columns):
-                if 'Timestamp' in str(df.columns[i]):
-                    worksheet.set_column(i, i, 20)
-                else:
-                    max_len = max(df[col].astype(str).map(len).max(), len(col)) + 2
-                    worksheet.set_column(i, i, min(max_len, 50))
-        
-        excel_data = output.getvalue()
+        excel_data = self.df_to_excel_bytes(df, f"{trading_pair[:15]}_{interval}")
         logger.info(f"Created Excel file for {trading_pair} ({len(excel_data)} bytes)")
-        return excel_data
\ No newline at end of file
+        return excel_data
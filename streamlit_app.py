@@ -1,6 +1,10 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from datetime import date, datetime, timedelta
-from kucoin_service import KuCoinService
+from kucoin_service import KuCoinService, _INTERVAL_S
 
 st.set_page_config(page_title="KuCoin Data Exporter", layout="centered", page_icon="📊")
 
@@ -11,9 +15,89 @@ def get_kucoin_service():
 
 service = get_kucoin_service()
 
+# File format -> (extension, mime type)
+EXPORT_FORMATS = {
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+    "CSV (gzip)": ("csv.gz", "application/gzip"),
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+# --- Cached Data ---
+# Keyed on the request tuple so resubmitting the same request skips the
+# network entirely. The cached functions take the service and the progress
+# callback with a leading underscore, which keeps them out of the key.
+def _fetch_kline_dataframe(service, symbol, interval, start_iso, end_iso, progress_callback):
+    # st.cache_data records element updates made on the thread running the
+    # cached function and replays them on every hit, so the fetch runs on a
+    # worker thread whose progress updates aren't recorded
+    ctx = get_script_run_ctx()
+
+    def fetch():
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return service.get_kline_data_as_dataframe(
+            symbol, interval, datetime.fromisoformat(start_iso), datetime.fromisoformat(end_iso), progress_callback
+        )
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(fetch).result()
+
+# Ranges whose last candle has closed are final, so they persist to disk
+# and survive restarts
+@st.cache_data(persist="disk", max_entries=32, show_spinner=False)
+def get_closed_kline_dataframe(_service, symbol, interval, start_iso, end_iso, _progress_callback):
+    return _fetch_kline_dataframe(_service, symbol, interval, start_iso, end_iso, _progress_callback)
+
+# Ranges with a still-open candle keep changing, so they only live in memory
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_open_kline_dataframe(_service, symbol, interval, start_iso, end_iso, _progress_callback):
+    return _fetch_kline_dataframe(_service, symbol, interval, start_iso, end_iso, _progress_callback)
+
+def _is_closed_range(interval, end_iso):
+    # The last candle opens at or before the range end and closes one
+    # interval later. _INTERVAL_S counts a month as 30 days, so allow 31
+    candle_s = 31 * 86400 if interval == '1month' else _INTERVAL_S[interval]
+    return int(datetime.fromisoformat(end_iso).timestamp()) + candle_s <= time.time()
+
+def get_kline_dataframe(service, symbol, interval, start_iso, end_iso):
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+
+    last_pct = 0
+
+    # Only push to the UI when progress advances by a whole percent, so
+    # concurrent fetches don't flood the frontend with updates
+    def progress_callback(progress, message):
+        nonlocal last_pct
+        pct = int(progress * 100)
+        if pct > last_pct:
+            progress_bar.progress(pct)
+            status_text.text(message)
+            last_pct = pct
+
+    try:
+        if _is_closed_range(interval, end_iso):
+            return get_closed_kline_dataframe(service, symbol, interval, start_iso, end_iso, progress_callback)
+        return get_open_kline_dataframe(service, symbol, interval, start_iso, end_iso, progress_callback)
+    finally:
+        # Clear progress indicators
+        progress_bar.empty()
+        status_text.empty()
+
+# Hashing df keys the file on the data itself, so the download always
+# matches the preview
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_export_data(_service, df, symbol, interval, file_format):
+    if df.empty:
+        return None
+    if file_format == "Parquet":
+        return _service.df_to_parquet_bytes(df)
+    if file_format == "CSV (gzip)":
+        return _service.df_to_csv_gz_bytes(df)
+    return _service.df_to_excel_bytes(df, f"{symbol[:15]}_{interval}")
+
 # --- UI ---
 st.title("📊 KuCoin Crypto Data Exporter")
-st.markdown("Download historical KuCoin k-line data to an Excel file.")
+st.markdown("Download historical KuCoin k-line data to a Parquet, CSV or Excel file.")
 
 # --- Settings Form ---
 with st.form(key="download_form"):
@@ -45,9 +129,16 @@ with st.form(key="download_form"):
         help="Select the end date for the data download."
     )
 
+    file_format = st.selectbox(
+        "File Format",
+        options=list(EXPORT_FORMATS),
+        index=0,  # Default to Parquet
+        help="Parquet and gzipped CSV are much faster to generate than Excel for large date ranges."
+    )
+
     st.subheader("2. Generate Data")
     submitted = st.form_submit_button(
-        "Generate Excel File", 
+        "Generate File", 
         type="primary", 
         use_container_width=True
     )
@@ -68,31 +159,24 @@ if submitted:
         start_datetime = datetime.combine(start_date, datetime.min.time())
         end_datetime = datetime.combine(end_date, datetime.max.time())
 
-        # Progress tracking
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-
-        def progress_callback(progress, message):
-            progress_bar.progress(progress)
-            status_text.text(message)
-
         with st.spinner(f"📡 Fetching data for {symbol} from {start_str} to {end_str}..."):
             try:
-                excel_data = service.export_to_excel(symbol, interval, start_datetime, end_datetime, progress_callback)
+                start_iso = start_datetime.isoformat()
+                end_iso = end_datetime.isoformat()
+                df = get_kline_dataframe(service, symbol, interval, start_iso, end_iso)
+                file_data = get_export_data(service, df, symbol, interval, file_format)
 
-                if excel_data:
-                    # Get DataFrame for preview
-                    df = service.get_kline_data_as_dataframe(symbol, interval, start_datetime, end_datetime)
-                    
+                if file_data:
                     st.success(f"✅ Found {len(df)} data points!")
 
-                    filename = f"KuCoin_{symbol}_{interval}_{start_date.strftime('%Y%m%d')}_to_{end_date.strftime('%Y%m%d')}.xlsx"
+                    extension, mime = EXPORT_FORMATS[file_format]
+                    filename = f"KuCoin_{symbol}_{interval}_{start_date.strftime('%Y%m%d')}_to_{end_date.strftime('%Y%m%d')}.{extension}"
                     
                     st.download_button(
-                        label="💾 Download Excel File",
-                        data=excel_data,
+                        label=f"💾 Download {file_format} File",
+                        data=file_data,
                         file_name=filename,
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        mime=mime,
                         use_container_width=True
                     )
 
@@ -102,7 +186,7 @@ if submitted:
                     with st.expander("📊 Data Statistics"):
                         col1, col2 = st.columns(2)
                         col1.metric("Total Records", f"{len(df):,}")
-                        col2.metric("File Size (KB)", f"{len(excel_data) / 1024:,.1f}")
+                        col2.metric("File Size (KB)", f"{len(file_data) / 1024:,.1f}")
                 else:
                     st.error("❌ No data found for the specified symbol and date range!")
 
@@ -110,10 +194,6 @@ if submitted:
                 st.error(f"An unexpected error occurred: {e}")
                 st.exception(e)
 
-        # Clear progress indicators
-        progress_bar.empty()
-        status_text.empty()
-
 # --- Footer ---
 st.markdown("---")
 st.caption("🔗 **Data Source:** KuCoin API | ⚠️ **Note:** Large date ranges may take time to download.")
@@ -0,0 +1,203 @@
+import functools
+from datetime import datetime
+
+import numpy as np
+import orjson
+import pytest
+from binance.client import Client
+from binance.exceptions import BinanceAPIException
+
+import binance_service
+from binance_service import BinanceReadService
+
+
+class FakeResponse:
+    def __init__(self, status, body, headers=None):
+        self.status = status
+        self.headers = headers or {}
+        self._body = body if isinstance(body, bytes) else orjson.dumps(body)
+
+    async def read(self):
+        return self._body
+
+    async def text(self):
+        return self._body.decode()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    """Stands in for aiohttp.ClientSession, answering every GET with handler(params)"""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.calls = []
+
+    def get(self, url, params=None):
+        self.calls.append((url, params))
+        return self.handler(params)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def _make_service(monkeypatch, handler, testnet=False):
+    # Skip the ping the real client sends on construction
+    monkeypatch.setattr(binance_service, 'Client', functools.partial(Client, ping=False))
+    session = FakeSession(handler)
+    monkeypatch.setattr(binance_service.aiohttp, 'ClientSession', lambda *args, **kwargs: session)
+    return BinanceReadService(testnet=testnet), session
+
+
+def test_fetch_uses_testnet_url(monkeypatch):
+    service, session = _make_service(monkeypatch, lambda params: FakeResponse(200, []), testnet=True)
+
+    service.get_historical_klines('BTCUSDT', '1d', '1 Jan 2024', '2 Jan 2024')
+
+    assert session.calls
+    assert all(url == 'https://testnet.binance.vision/api/v3/klines' for url, _ in session.calls)
+
+
+def _kline(open_ms):
+    return [open_ms, '1.5', '3.5', '0.5', '2.5', '10.25', open_ms + 59_999, '20.125', 42, '5.5', '6.5', '0']
+
+
+def _record_sleeps(monkeypatch):
+    sleeps = []
+
+    async def fake_async_sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(binance_service.asyncio, 'sleep', fake_async_sleep)
+    monkeypatch.setattr(binance_service, 'sleep', sleeps.append)
+    return sleeps
+
+
+def test_page_windows_end_one_ms_before_the_next_start():
+    step = binance_service.KLINE_LIMIT * 60_000
+
+    windows = binance_service._page_windows(0, 2 * step + 5, 60_000)
+
+    assert windows == [(0, step - 1), (step, 2 * step - 1), (2 * step, 2 * step + 5)]
+
+
+def test_get_historical_klines_defaults_end_time_to_now(monkeypatch):
+    now = datetime(2024, 1, 2)
+
+    class FixedDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return now
+
+    monkeypatch.setattr(binance_service, 'datetime', FixedDatetime)
+    service, session = _make_service(monkeypatch, lambda params: FakeResponse(200, [_kline(0)]))
+
+    service.get_historical_klines('BTCUSDT', '1m', '1 Jan 2024')
+
+    assert session.calls[-1][1]['endTime'] == int(now.timestamp() * 1000)
+
+
+def test_get_historical_klines_starts_at_the_first_kline(monkeypatch):
+    listed_ms = 1_704_067_200_000
+    service, session = _make_service(monkeypatch, lambda params: FakeResponse(200, [_kline(listed_ms)]))
+
+    service.get_historical_klines('BTCUSDT', '1d', '1 Jan 2010', '2 Jan 2024')
+
+    assert session.calls[0][1]['startTime'] == 0
+    assert session.calls[1][1]['startTime'] == listed_ms
+
+
+def test_non_retriable_error_is_raised_once(monkeypatch):
+    sleeps = _record_sleeps(monkeypatch)
+    service, session = _make_service(
+        monkeypatch, lambda params: FakeResponse(400, {'code': -1121, 'msg': 'Invalid symbol.'})
+    )
+
+    with pytest.raises(BinanceAPIException) as excinfo:
+        service.get_historical_klines('BAD', '1d', '1 Jan 2024', '2 Jan 2024')
+
+    assert excinfo.value.code == -1121
+    assert len(session.calls) == 1
+    assert sleeps == []
+
+
+def test_ip_ban_is_raised_once(monkeypatch):
+    sleeps = _record_sleeps(monkeypatch)
+    service, session = _make_service(
+        monkeypatch, lambda params: FakeResponse(418, {'code': -1003, 'msg': 'IP banned.'}, {'Retry-After': '120'})
+    )
+
+    with pytest.raises(BinanceAPIException):
+        service.get_historical_klines('BTCUSDT', '1d', '1 Jan 2024', '2 Jan 2024')
+
+    assert len(session.calls) == 1
+    assert sleeps == []
+
+
+def test_non_json_error_body_is_reported(monkeypatch):
+    service, session = _make_service(monkeypatch, lambda params: FakeResponse(403, b'<html>Forbidden</html>'))
+
+    with pytest.raises(binance_service.BinanceHTTPError) as excinfo:
+        service.get_historical_klines('BTCUSDT', '1d', '1 Jan 2024', '2 Jan 2024')
+
+    assert excinfo.value.status_code == 403
+    assert excinfo.value.text == '<html>Forbidden</html>'
+    assert len(session.calls) == 1
+
+
+def test_page_retries_do_not_rerun_the_whole_fetch(monkeypatch):
+    sleeps = _record_sleeps(monkeypatch)
+    service, session = _make_service(monkeypatch, lambda params: FakeResponse(500, {'code': -1000, 'msg': 'Unknown.'}))
+
+    with pytest.raises(BinanceAPIException):
+        service.get_historical_klines('BTCUSDT', '1d', '1 Jan 2024', '2 Jan 2024')
+
+    assert len(session.calls) == binance_service.MAX_RETRIES
+    assert sleeps == [1, 2]
+
+
+def test_retry_after_zero_is_honored(monkeypatch):
+    sleeps = _record_sleeps(monkeypatch)
+    responses = [FakeResponse(429, {'code': -1003, 'msg': 'Too many requests.'}, {'Retry-After': '0'})]
+    service, session = _make_service(
+        monkeypatch, lambda params: responses.pop() if responses else FakeResponse(200, [_kline(0)])
+    )
+
+    service.get_historical_klines('BTCUSDT', '1d', '1 Jan 2024', '2 Jan 2024')
+
+    assert sleeps == [0.0]
+
+
+def test_retry_after_is_capped(monkeypatch):
+    sleeps = _record_sleeps(monkeypatch)
+    responses = [FakeResponse(429, {'code': -1003, 'msg': 'Too many requests.'}, {'Retry-After': '3600'})]
+    service, session = _make_service(
+        monkeypatch, lambda params: responses.pop() if responses else FakeResponse(200, [_kline(0)])
+    )
+
+    service.get_historical_klines('BTCUSDT', '1d', '1 Jan 2024', '2 Jan 2024')
+
+    assert sleeps == [binance_service.MAX_RETRY_AFTER]
+
+
+def test_process_dataframe_types_each_column(monkeypatch):
+    service, _ = _make_service(monkeypatch, lambda params: FakeResponse(200, []))
+
+    df = service._process_dataframe([_kline(1_704_067_200_000)])
+
+    assert 'CanBeIgnored' not in df.columns
+    assert df['OpenTime'].dtype == 'datetime64[ns]'
+    assert df['CloseTime'].dtype == 'datetime64[ns]'
+    assert df['NumberOfTrades'].dtype == np.int32
+    assert all(df[col].dtype == np.float64 for col in binance_service.FLOAT_COLUMNS)
+    assert df['OpenTime'].iloc[0] == datetime(2024, 1, 1)
+    assert df['CloseTime'].iloc[0] == datetime(2024, 1, 1, 0, 0, 59, 999000)
+    assert df['Close'].iloc[0] == 2.5
+    assert df['NumberOfTrades'].iloc[0] == 42
@@ -0,0 +1,48 @@
+from datetime import datetime
+
+from kucoin_service import KuCoinService
+
+
+def _kline(ts):
+    return [str(ts), '1.5', '2.5', '3.5', '0.5', '10.25', '20.125']
+
+
+def test_get_kline_data_as_dataframe_skips_empty_windows(monkeypatch):
+    service = KuCoinService()
+
+    # Newest window first, each window newest kline first, with an empty
+    # window in the middle and a duplicate timestamp at a window boundary
+    chunks = [
+        [_kline(1704254400), _kline(1704168000)],
+        [],
+        [_kline(1704168000), _kline(1704081600)],
+        [],
+    ]
+
+    async def fake_fetch_windows(symbol, interval, windows, progress_callback=None):
+        return chunks
+
+    monkeypatch.setattr(service, '_fetch_windows', fake_fetch_windows)
+
+    df = service.get_kline_data_as_dataframe('BTCUSDT', '1day', datetime(2024, 1, 1), datetime(2024, 1, 3))
+
+    assert list(df['Timestamp']) == [
+        datetime(2024, 1, 1, 4), datetime(2024, 1, 2, 4), datetime(2024, 1, 3, 4)
+    ]
+    assert list(df.columns) == ['Timestamp', 'Open', 'High', 'Low', 'Close', 'Amount', 'Volume']
+    assert df['Close'].tolist() == [2.5, 2.5, 2.5]
+
+
+def test_get_kline_data_as_dataframe_keeps_full_precision(monkeypatch):
+    service = KuCoinService()
+    kline = ['1704067200', '60000.12', '60000.12', '60000.12', '60000.12', '12.5', '1234567890.12']
+
+    async def fake_fetch_windows(symbol, interval, windows, progress_callback=None):
+        return [[kline]]
+
+    monkeypatch.setattr(service, '_fetch_windows', fake_fetch_windows)
+
+    df = service.get_kline_data_as_dataframe('BTCUSDT', '1day', datetime(2024, 1, 1), datetime(2024, 1, 2))
+
+    assert df['Close'].iloc[0] == 60000.12
+    assert df['Volume'].iloc[0] == 1234567890.12